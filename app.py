@@ -1,12 +1,18 @@
 import os
+import json
+import time
+import hashlib
 import logging
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, session
 import uuid
 from flask_cors import CORS
+from flask_compress import Compress
 from functools import lru_cache
 from dotenv import load_dotenv
+from sqlalchemy import event, insert, or_, and_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import load_only
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,38 +28,149 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///plant_disease.db")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+app.config["SLOW_QUERY_THRESHOLD_MS"] = 100
+app.config["TREATMENT_CACHE_TTL"] = 7 * 24 * 60 * 60  # 7 days
+app.config["RESULTS_PAGE_SIZE"] = 20
+app.config["RESULT_CACHE_TTL"] = 24 * 60 * 60  # 1 day
+app.config["ASYNC_INFERENCE"] = bool(os.environ.get("CELERY_BROKER_URL"))  # Run inference on Celery workers
 app.config["UPLOAD_FOLDER"] = "static/uploads"
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max upload
 app.config["ALLOWED_EXTENSIONS"] = {'png', 'jpg', 'jpeg', 'gif'}
+app.config["UPLOAD_CACHE_MAX_AGE"] = 365 * 24 * 60 * 60  # 1 year
+app.config["UPLOAD_CHUNK_SIZE"] = 1 << 20  # 1MB
+
+# Leading bytes of each allowed image type and the extension to save it under
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpg',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
 
 # Enable CORS
 CORS(app)
 
+# Compress responses (gzip, or brotli when the client supports it)
+Compress(app)
+
 # Ensure upload directory exists
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
 # Import models and initialize database
-from models import db, User, PlantDiseaseResult
+from models import db, User, PlantDiseaseResult, upgrade_schema
 db.init_app(app)
 
-# Create database tables
+# Import services after app creation
+from plant_disease_detector import detect_disease, load_model
+from gemini_service import get_treatment_recommendation, fallback_treatment, UNAVAILABLE_TREATMENT, chat_with_gemini, initialize_chat
+from cache_service import cache_get, cache_set
+from tasks import run_inference
+
+# Create database tables and load the model before serving any traffic
 with app.app_context():
     db.create_all()
+    upgrade_schema()
+    
+    # With asynchronous inference the model is only needed by the Celery workers
+    if not app.config["ASYNC_INFERENCE"]:
+        try:
+            load_model()
+        except Exception as e:
+            # detect_disease retries the load on the first upload
+            logger.error(f"Error preloading model: {str(e)}")
 
-# Import services after app creation
-from plant_disease_detector import detect_disease
-from gemini_service import get_treatment_recommendation, chat_with_gemini, initialize_chat
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Log queries that take longer than SLOW_QUERY_THRESHOLD_MS"""
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    if elapsed_ms > app.config["SLOW_QUERY_THRESHOLD_MS"]:
+        logger.warning(f"Slow query ({elapsed_ms:.1f} ms): {statement}")
+
+@app.after_request
+def cache_uploaded_images(response):
+    """Let clients cache uploaded images forever; uploads are named by content hash and never change"""
+    if request.path.startswith('/static/uploads/') and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["UPLOAD_CACHE_MAX_AGE"]
+        response.cache_control.immutable = True
+    return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def sniff_image_extension(header):
+    """Return the extension for the image type identified by the header bytes, or None"""
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return extension
+    return None
+
+def parse_before_param():
+    """Parse the optional ?before=<result id> keyset pagination cursor (raises ValueError)"""
+    before = request.args.get('before')
+    return int(before) if before else None
+
+def next_page_cursor(results):
+    """Cursor for the page after these results, or None if this is the last page"""
+    if len(results) == app.config["RESULTS_PAGE_SIZE"]:
+        return results[-1].id
+    return None
+
+def latest_results_query(query, before_id=None):
+    """Order finished results newest first, starting after the result with id before_id"""
+    # Pending and failed uploads have no prediction to show yet
+    query = query.filter(PlantDiseaseResult.status == 'completed')
+    if before_id is not None:
+        # Keyset on (timestamp, id), since timestamps are not unique. The cursor row's stored
+        # timestamp is compared rather than a re-parsed copy, so both sides share one format
+        cursor_timestamp = db.session.query(PlantDiseaseResult.timestamp).filter(
+            PlantDiseaseResult.id == before_id
+        ).scalar_subquery()
+        query = query.filter(or_(
+            PlantDiseaseResult.timestamp < cursor_timestamp,
+            and_(PlantDiseaseResult.timestamp == cursor_timestamp, PlantDiseaseResult.id < before_id)
+        ))
+    return query.order_by(
+        PlantDiseaseResult.timestamp.desc(),
+        PlantDiseaseResult.id.desc()
+    ).limit(app.config["RESULTS_PAGE_SIZE"])
+
+class TreatmentUnavailable(Exception):
+    """Raised instead of returning a fallback treatment, so caches never store it"""
+
 @lru_cache(maxsize=100)
+def _get_shared_treatment(disease_name):
+    """In-process LRU in front of a cache shared by all workers that survives restarts"""
+    cache_key = f"treat:{disease_name}"
+    treatment = cache_get(cache_key)
+    if treatment is not None:
+        return treatment
+    
+    treatment = get_treatment_recommendation(disease_name)
+    
+    # Don't cache a fallback at either level so a transient Gemini outage isn't served for days
+    if treatment in (fallback_treatment(disease_name), UNAVAILABLE_TREATMENT):
+        raise TreatmentUnavailable(treatment)
+    
+    cache_set(cache_key, treatment, app.config["TREATMENT_CACHE_TTL"])
+    return treatment
+
 def get_cached_treatment(disease_name):
     """Cache treatment recommendations to reduce API calls"""
-    return get_treatment_recommendation(disease_name)
+    try:
+        return _get_shared_treatment(disease_name)
+    except TreatmentUnavailable as e:
+        return e.args[0]
 
 @app.route('/')
 def index():
@@ -62,9 +179,27 @@ def index():
 @app.route('/history')
 def history():
     try:
-        # Fetch the latest 20 results
-        results = PlantDiseaseResult.query.order_by(PlantDiseaseResult.timestamp.desc()).limit(20).all()
-        return render_template('history.html', results=results)
+        before = parse_before_param()
+    except ValueError:
+        flash("Invalid history page requested.", "error")
+        return redirect(url_for('history'))
+    
+    try:
+        # Fetch the latest 20 results, loading only the columns the page shows
+        results = latest_results_query(
+            PlantDiseaseResult.query.options(
+                load_only(
+                    PlantDiseaseResult.id,
+                    PlantDiseaseResult.image_path,
+                    PlantDiseaseResult.prediction,
+                    PlantDiseaseResult.confidence,
+                    PlantDiseaseResult.timestamp
+                )
+            ),
+            before
+        ).all()
+        
+        return render_template('history.html', results=results, next_before=next_page_cursor(results))
     except Exception as e:
         logger.error(f"Error fetching history: {str(e)}")
         flash("Error loading history. Please try again later.", "error")
@@ -91,51 +226,118 @@ def chat():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file part'}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'File type not allowed'}), 400
+        
+        stream = file.stream
+    else:
+        # Raw image body (e.g. application/octet-stream), read straight from the request
+        stream = request.stream
     
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+    # Validate the content itself rather than trusting the filename
+    header = stream.read(16)
+    if not header:
+        return jsonify({'error': 'No file part'}), 400
     
-    if not allowed_file(file.filename):
+    file_extension = sniff_image_extension(header)
+    if file_extension is None:
         return jsonify({'error': 'File type not allowed'}), 400
     
+    temp_path = None
+    file_path = None
+    image_hash = None
+    result_id = None
     try:
-        # Generate a unique filename
-        filename = secure_filename(file.filename)
-        file_extension = os.path.splitext(filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        # Stream the uploaded file to a temporary file in chunks, hashing it as it is written
+        hasher = hashlib.sha256(header)
+        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".{uuid.uuid4()}.part")
+        chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            while chunk := stream.read(chunk_size):
+                hasher.update(chunk)
+                f.write(chunk)
+        image_hash = hasher.hexdigest()
+        
+        # Name the file after its content so identical uploads share a single copy
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_hash}.{file_extension}")
+        os.replace(temp_path, file_path)
+        temp_path = None
         
-        # Save the uploaded file
-        file.save(file_path)
+        # Reuse the result of an earlier upload of the same image. Only finished results
+        # count: a pending one may belong to a lost task or an upload that is about to fail
+        existing = PlantDiseaseResult.query.filter_by(
+            image_hash=image_hash,
+            status='completed'
+        ).order_by(PlantDiseaseResult.id.desc()).first()
+        if existing:
+            return jsonify(existing.to_dict()), 200
         
-        # Process the image with the disease detection model
-        prediction, confidence = detect_disease(file_path)
+        if not app.config["ASYNC_INFERENCE"]:
+            # Process the image with the disease detection model in this request, then write
+            # the finished result and get its id back in a single round trip
+            prediction, confidence = detect_disease(file_path)
+            timestamp = datetime.now()
+            stmt = insert(PlantDiseaseResult).values(
+                image_path=file_path,
+                image_hash=image_hash,
+                prediction=prediction,
+                confidence=float(confidence),
+                status='completed',
+                timestamp=timestamp
+            ).returning(PlantDiseaseResult.id)
+            result_id = db.session.execute(stmt).scalar_one()
+            db.session.commit()
+            
+            return jsonify({
+                'id': result_id,
+                'image_path': file_path,
+                'prediction': prediction,
+                'confidence': float(confidence),
+                'user_id': None,
+                'status': 'completed',
+                'timestamp': timestamp.isoformat()
+            }), 200
         
-        # Save the result to the database
-        result = PlantDiseaseResult(
+        # Record the upload as pending until a Celery worker has run inference on it
+        stmt = insert(PlantDiseaseResult).values(
             image_path=file_path,
-            prediction=prediction,
-            confidence=float(confidence),
+            image_hash=image_hash,
+            prediction='',
+            confidence=0.0,
+            status='pending',
             timestamp=datetime.now()
-        )
-        db.session.add(result)
+        ).returning(PlantDiseaseResult.id)
+        result_id = db.session.execute(stmt).scalar_one()
         db.session.commit()
         
+        # Hand inference to a Celery worker; the client polls the result URL
+        run_inference.delay(file_path, result_id)
         return jsonify({
-            'id': result.id,
-            'image_path': file_path,
-            'prediction': prediction,
-            'confidence': confidence,
-            'timestamp': result.timestamp.isoformat()
-        }), 200
+            'id': result_id,
+            'status': 'pending',
+            'result_url': url_for('get_result', result_id=result_id)
+        }), 202
     
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
-        if os.path.exists(file_path):
-            os.remove(file_path)  # Clean up the file if it was saved
+        db.session.rollback()
+        if result_id is not None:
+            PlantDiseaseResult.query.filter_by(id=result_id).delete()
+            db.session.commit()
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)  # Clean up a partially written upload
+        # Clean up the file if it was saved, unless another result still uses it
+        if file_path and os.path.exists(file_path) and not PlantDiseaseResult.query.filter_by(image_hash=image_hash).first():
+            os.remove(file_path)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/get_treatment', methods=['POST'])
@@ -157,11 +359,22 @@ def get_treatment():
 @app.route('/api/results', methods=['GET'])
 def get_results():
     try:
-        # Get the latest results (limited to 20)
-        results = PlantDiseaseResult.query.order_by(PlantDiseaseResult.timestamp.desc()).limit(20).all()
+        before = parse_before_param()
+    except ValueError:
+        return jsonify({'error': 'before must be a result id'}), 400
+    
+    try:
+        # Get the latest results (limited to 20), older than ?before= when paginating
+        results = latest_results_query(PlantDiseaseResult.query, before).all()
         
         results_list = [result.to_dict() for result in results]
-        return jsonify(results_list), 200
+        response = jsonify(results_list)
+        
+        # Point clients at the next page without changing the response body
+        next_before = next_page_cursor(results)
+        if next_before is not None:
+            response.headers['Link'] = f'<{url_for("get_results", before=next_before)}>; rel="next"'
+        return response, 200
     
     except Exception as e:
         logger.error(f"Error fetching results: {str(e)}")
@@ -170,8 +383,19 @@ def get_results():
 @app.route('/api/result/<int:result_id>', methods=['GET'])
 def get_result(result_id):
     try:
+        # Finished results never change, so serve repeat views from the cache
+        cache_key = f"res:{result_id}"
+        cached = cache_get(cache_key)
+        if cached is not None:
+            return Response(cached, mimetype='application/json'), 200
+        
         result = PlantDiseaseResult.query.get_or_404(result_id)
-        return jsonify(result.to_dict()), 200
+        result_dict = result.to_dict()
+        
+        # Pending results are still being updated by inference, so only cache finished ones
+        if result.status != 'pending':
+            cache_set(cache_key, json.dumps(result_dict), app.config["RESULT_CACHE_TTL"])
+        return jsonify(result_dict), 200
     except Exception as e:
         logger.error(f"Error fetching result {result_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
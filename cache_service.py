@@ -0,0 +1,93 @@
+import os
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Shared cache configuration: Redis when reachable, otherwise an on-disk cache
+REDIS_URL = os.environ.get("REDIS_URL", "")
+DISK_CACHE_DIR = os.environ.get("DISK_CACHE_DIR", "/tmp/treatment_cache")
+
+redis_client = None
+disk_cache = None
+
+def _init_backend():
+    """Connect to Redis, falling back to diskcache if Redis is unavailable"""
+    global redis_client, disk_cache
+    if REDIS_URL:
+        try:
+            import redis
+            client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+            client.ping()
+            redis_client = client
+            logger.info("Using Redis for the shared cache")
+            return
+        except Exception as e:
+            logger.warning(f"Redis unavailable, falling back to disk cache: {str(e)}")
+    
+    try:
+        import diskcache
+        disk_cache = diskcache.Cache(DISK_CACHE_DIR)
+        logger.info(f"Using disk cache at {DISK_CACHE_DIR}")
+    except Exception as e:
+        logger.warning(f"No shared cache available: {str(e)}")
+
+def cache_get(key):
+    """
+    Get a value from the shared cache
+    
+    Args:
+        key (str): The cache key
+    
+    Returns:
+        str: The cached value, or None on a miss or cache error
+    """
+    try:
+        if redis_client is not None:
+            return redis_client.get(key)
+        if disk_cache is not None:
+            return disk_cache.get(key)
+    except Exception as e:
+        logger.warning(f"Error reading {key} from cache: {str(e)}")
+    return None
+
+def cache_set(key, value, ttl):
+    """
+    Store a value in the shared cache
+    
+    Args:
+        key (str): The cache key
+        value (str): The value to store
+        ttl (int): Time to live in seconds
+    
+    Returns:
+        None
+    """
+    try:
+        if redis_client is not None:
+            redis_client.setex(key, ttl, value)
+        elif disk_cache is not None:
+            disk_cache.set(key, value, expire=ttl)
+    except Exception as e:
+        logger.warning(f"Error writing {key} to cache: {str(e)}")
+
+def cache_delete(key):
+    """
+    Remove a value from the shared cache
+    
+    Args:
+        key (str): The cache key
+    
+    Returns:
+        None
+    """
+    try:
+        if redis_client is not None:
+            redis_client.delete(key)
+        elif disk_cache is not None:
+            disk_cache.delete(key)
+    except Exception as e:
+        logger.warning(f"Error deleting {key} from cache: {str(e)}")
+
+_init_backend()
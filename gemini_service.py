@@ -14,9 +14,17 @@ if not API_KEY:
 # Configure the Gemini API client
 genai.configure(api_key=API_KEY)
 
+# Shared model instance, so calls don't rebuild the GenerativeModel wrapper each time
+# (the underlying API client is already a process-wide singleton in google-generativeai)
+MODEL_NAME = 'gemini-1.5-pro'
+gemini_model = genai.GenerativeModel(MODEL_NAME)
+
 # Store chat sessions
 chat_history = {}
 
+# Returned when Gemini answers without any content
+UNAVAILABLE_TREATMENT = "Unable to generate treatment recommendations at this time."
+
 def get_treatment_recommendation(disease_name):
     """
     Get treatment recommendations for a plant disease using Google Gemini
@@ -44,23 +52,32 @@ def get_treatment_recommendation(disease_name):
         Keep your response informative but concise (less than 500 words).
         """
         
-        # Initialize the Gemini model
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        
         # Generate the response
-        response = model.generate_content(prompt)
+        response = gemini_model.generate_content(prompt)
         
         # Extract and return the text
         if response:
             return response.text
         else:
-            return "Unable to generate treatment recommendations at this time."
+            return UNAVAILABLE_TREATMENT
     
     except Exception as e:
         logger.error(f"Error generating treatment recommendations: {str(e)}")
         
         # Fallback response if Gemini API fails
-        return f"""
+        return fallback_treatment(disease_name)
+
+def fallback_treatment(disease_name):
+    """
+    Generic treatment recommendations used when Gemini is unavailable
+    
+    Args:
+        disease_name (str): The name of the plant disease
+    
+    Returns:
+        str: Generic treatment recommendations
+    """
+    return f"""
         # Treatment Recommendations for {disease_name.replace('_', ' ')}
 
         ## Description
@@ -100,12 +117,9 @@ def initialize_chat(session_id):
             logger.warning("Cannot initialize chat: GEMINI_API_KEY not found")
             return False
             
-        # Initialize the Gemini model for chat
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        
         # Initialize chat session with system prompt (Gemini doesn't support system messages in the same way)
         # So we'll start with an initial user/model exchange to set context
-        chat = model.start_chat()
+        chat = gemini_model.start_chat()
         
         # Prime the chat with initial context
         system_prompt = """You are PlantCare AI, a helpful agriculture assistant that specializes in plant disease diagnosis and treatment. 
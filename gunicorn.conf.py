@@ -0,0 +1,27 @@
+import os
+
+# Gunicorn configuration, picked up automatically when running `gunicorn main:app`
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Load the app (and the model weights, on the CPU) once in the master so forked
+# workers share the weight pages copy-on-write instead of each loading their own copy.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+def post_fork(server, worker):
+    """Move the model to the GPU / open the ONNX session in each worker, never in the master"""
+    import plant_disease_detector
+    if plant_disease_detector.model is not None:
+        plant_disease_detector.prepare_runtime()
+
+# Handlers mostly wait on the Gemini API and the database. google-generativeai
+# talks gRPC through a C extension that gevent cannot monkeypatch, so use
+# threaded workers rather than gevent. Inference runs on the batch worker
+# thread in plant_disease_detector, so request threads only queue images and wait.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+
+# Every worker runs its own inference batch queue and thread pool, so keep the
+# worker count small and split the cores between them rather than oversubscribing
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+os.environ.setdefault("INFERENCE_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
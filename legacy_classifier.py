@@ -0,0 +1,170 @@
+import random
+import cv2
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Feature-based classifier that predates the trained model. It lives outside
+# plant_disease_detector so OpenCV is only loaded by code that actually uses it;
+# import this module lazily, from inside the functions that need it.
+
+# The class names for the plant disease detection model
+CLASSES = [
+    'Apple_Apple_scab', 'Apple_Black_rot', 'Apple_Cedar_apple_rust', 'Apple_Healthy',
+    'Background_without_leaves', 'Blueberry_Healthy', 'Cherry_Powdery_mildew', 'Cherry_Healthy',
+    'Corn_Cercospora_leaf_spot', 'Corn_Common_rust', 'Corn_Northern_Leaf_Blight', 'Corn_Healthy',
+    'Grape_Black_rot', 'Grape_Esca', 'Grape_Leaf_blight', 'Grape_Healthy',
+    'Orange_Haunglongbing', 'Peach_Bacterial_spot', 'Peach_Healthy',
+    'Pepper_Bacterial_spot', 'Pepper_Healthy', 'Potato_Early_blight', 'Potato_Late_blight', 'Potato_Healthy',
+    'Raspberry_Healthy', 'Soybean_Healthy', 'Squash_Powdery_mildew',
+    'Strawberry_Leaf_scorch', 'Strawberry_Healthy', 'Tomato_Bacterial_spot', 'Tomato_Early_blight',
+    'Tomato_Late_blight', 'Tomato_Leaf_Mold', 'Tomato_Septoria_leaf_spot',
+    'Tomato_Spider_mites', 'Tomato_Target_Spot', 'Tomato_Mosaic_virus', 'Tomato_Yellow_Leaf_Curl_Virus', 'Tomato_Healthy'
+]
+
+# Common disease indicators and their corresponding colors in HSV space
+DISEASE_INDICATORS = {
+    "Brown spots": [(10, 100, 20), (20, 255, 200)],  # Brown
+    "Yellow spots": [(20, 100, 100), (30, 255, 255)],  # Yellow
+    "Black spots": [(0, 0, 0), (180, 255, 30)],  # Black
+    "White powder": [(0, 0, 200), (180, 30, 255)],  # White
+    "Rotting": [(0, 50, 10), (15, 255, 100)]  # Dark brown
+}
+
+# Lower and upper HSV bounds of the disease indicators, shape (indicators, 3)
+INDICATOR_LOWERS = np.array([lower for lower, _ in DISEASE_INDICATORS.values()], dtype=np.uint8)
+INDICATOR_UPPERS = np.array([upper for _, upper in DISEASE_INDICATORS.values()], dtype=np.uint8)
+
+def _color_kernel(hsv, lowers, uppers, out_ratios, out_means):
+    """Compute all indicator ratios and channel means in a single pass over the image"""
+    rows, cols = hsv.shape[0], hsv.shape[1]
+    indicators = lowers.shape[0]
+    
+    # Per-row partial results, so parallel rows never write to the same slot
+    row_counts = np.zeros((rows, indicators), dtype=np.int64)
+    row_sums = np.zeros((rows, 3), dtype=np.float64)
+    for r in prange(rows):
+        for c in range(cols):
+            h = hsv[r, c, 0]
+            s = hsv[r, c, 1]
+            v = hsv[r, c, 2]
+            row_sums[r, 0] += h
+            row_sums[r, 1] += s
+            row_sums[r, 2] += v
+            for k in range(indicators):
+                if (lowers[k, 0] <= h <= uppers[k, 0]
+                        and lowers[k, 1] <= s <= uppers[k, 1]
+                        and lowers[k, 2] <= v <= uppers[k, 2]):
+                    row_counts[r, k] += 1
+    
+    pixels = rows * cols
+    for k in range(indicators):
+        out_ratios[k] = row_counts[:, k].sum() / pixels
+    for channel in range(3):
+        out_means[channel] = row_sums[:, channel].sum() / pixels / 255.0
+
+# Compile the fused kernel when Numba is installed, otherwise use the numpy version below
+if njit is not None:
+    _color_kernel = njit(parallel=True, fastmath=True, cache=True)(_color_kernel)
+else:
+    _color_kernel = None
+
+def extract_color_features(img):
+    """Extract color features from the image"""
+    # Convert to HSV color space for better color feature extraction
+    hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+    
+    if _color_kernel is not None:
+        ratios = np.empty(len(INDICATOR_LOWERS))
+        channel_means = np.empty(3)
+        _color_kernel(hsv, INDICATOR_LOWERS, INDICATOR_UPPERS, ratios, channel_means)
+        return np.concatenate([ratios, channel_means])
+    
+    # Check every disease indicator (color range) at once by broadcasting the
+    # per-channel bounds against the image, giving one (H, W) mask per indicator
+    h, s, v = hsv[None, :, :, 0], hsv[None, :, :, 1], hsv[None, :, :, 2]
+    lowers = INDICATOR_LOWERS[:, :, None, None]
+    uppers = INDICATOR_UPPERS[:, :, None, None]
+    masks = (
+        (h >= lowers[:, 0]) & (h <= uppers[:, 0])
+        & (s >= lowers[:, 1]) & (s <= uppers[:, 1])
+        & (v >= lowers[:, 2]) & (v <= uppers[:, 2])
+    )
+    
+    # Calculate percentage of image with each color indicator
+    ratios = masks.mean(axis=(1, 2))
+    
+    # Add average color features (mean of each HSV channel)
+    channel_means = hsv.reshape(-1, 3).mean(axis=0) / 255.0
+    
+    return np.concatenate([ratios, channel_means])
+
+def extract_texture_features(img):
+    """Extract texture features using gradient magnitude"""
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    
+    # Calculate gradient magnitude (simple edge detection) in single precision
+    sobelx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    sobely = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    gradient_mag = cv2.magnitude(sobelx, sobely)
+    
+    # Normalize in place by the maximum (an all-zero image stays zero)
+    cv2.normalize(gradient_mag, gradient_mag, 1.0, 0.0, cv2.NORM_INF)
+    
+    # Add mean, std as features
+    mean, std = cv2.meanStdDev(gradient_mag)
+    
+    features = [
+        mean[0, 0],  # Average edge strength
+        std[0, 0],   # Variation in edge strength
+        np.percentile(gradient_mag, 90)  # Strong edge percentile
+    ]
+    
+    return np.array(features)
+
+# Threshold rules for simple_disease_classifier, in priority order:
+# high brown spots (Apple scab, Black rot), high yellow spots (Leaf spot diseases),
+# white powdery appearance (Powdery mildew), dark spots (Late blight)
+RULE_FEATURES = np.array([0, 1, 3, 2])
+RULE_THRESHOLDS = np.array([0.15, 0.2, 0.1, 0.12])
+# Candidate classes per rule; one is picked at random when a rule has several
+RULE_CLASSES = [
+    (1, 0),  # Apple_Black_rot or Apple_Apple_scab
+    (30,),   # Tomato_Early_blight
+    (6,),    # Cherry_Powdery_mildew
+    (31,),   # Tomato_Late_blight
+]
+
+def simple_disease_classifier(features):
+    """A simple classifier based on extracted features"""
+    # This is a simplified approach that simulates the ResNet model
+    # In a production environment, a properly trained model would be used
+    
+    # Split features
+    features = np.asarray(features)
+    color_features = features[:8]  # First 8 features are color-related
+    texture_features = features[8:]  # Last 3 features are texture-related
+    
+    # Check for specific disease patterns based on feature thresholds, all at once;
+    # the first matching rule in table order wins
+    hits = features[RULE_FEATURES] > RULE_THRESHOLDS
+    
+    # Brown spots only indicate Apple scab / Black rot together with high edge variation
+    hits[0] &= texture_features[1] > 0.2
+    
+    if hits.any():
+        return random.choice(RULE_CLASSES[int(np.argmax(hits))])
+    
+    # Check if mostly green (healthy)
+    if np.mean(color_features[:5]) < 0.1 and color_features[5] > 0.4:  # Low disease indicators and high green
+        # Choose a random healthy class
+        healthy_indices = [3, 5, 7, 11, 15, 18, 20, 23, 24, 25, 28, 38]
+        return random.choice(healthy_indices)
+    
+    # Fall back to a random disease if no specific pattern is detected
+    # This simulates the model prediction for demonstration purposes
+    return random.randint(0, len(CLASSES) - 1)
@@ -1,5 +1,7 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
 from flask_login import UserMixin
 
 db = SQLAlchemy()
@@ -22,11 +24,19 @@ class PlantDiseaseResult(db.Model):
     """Model to store plant disease detection results"""
     id = db.Column(db.Integer, primary_key=True)
     image_path = db.Column(db.String(255), nullable=False)
+    image_hash = db.Column(db.String(64), index=True, nullable=True)  # SHA-256 of the uploaded file
+    # Prediction and confidence are placeholders ('' and 0.0) while inference is pending
     prediction = db.Column(db.String(100), nullable=False)
     confidence = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='completed')  # pending, completed or failed
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Newest-first index backing the history and results listings and their (timestamp, id) cursor
+    __table_args__ = (
+        db.Index('ix_pdr_timestamp_id_desc', timestamp.desc(), id.desc()),
+    )
+    
     def __repr__(self):
         return f'<PlantDiseaseResult {self.id} - {self.prediction}>'
 
@@ -38,5 +48,53 @@ class PlantDiseaseResult(db.Model):
             'prediction': self.prediction,
             'confidence': self.confidence,
             'user_id': self.user_id,
+            'status': self.status,
             'timestamp': self.timestamp.isoformat()
         }
+
+# Columns added to plant_disease_result after its first release, with the DDL
+# that adds each one to an existing table
+ADDED_COLUMNS = {
+    'status': "ALTER TABLE plant_disease_result ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'completed'",
+    'image_hash': "ALTER TABLE plant_disease_result ADD COLUMN image_hash VARCHAR(64)",
+}
+
+# Indexes replaced by later ones
+OBSOLETE_INDEXES = ['ix_pdr_timestamp_desc']
+
+def _existing_columns(table_name):
+    return {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+
+def _existing_indexes(table_name):
+    return {index['name'] for index in inspect(db.engine).get_indexes(table_name)}
+
+def upgrade_schema():
+    """Bring an existing plant_disease_result table up to date
+
+    db.create_all() only creates missing tables, so columns and indexes added
+    since a database was created are added here. Safe to run on every start-up,
+    including from several processes at once: if another process adds a column
+    or index first, the resulting error is ignored.
+    """
+    table = PlantDiseaseResult.__table__
+    
+    for column, ddl in ADDED_COLUMNS.items():
+        if column in _existing_columns(table.name):
+            continue
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(ddl))
+        except SQLAlchemyError:
+            if column not in _existing_columns(table.name):
+                raise
+    
+    with db.engine.begin() as conn:
+        for index in OBSOLETE_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    
+    for index in table.indexes:
+        try:
+            index.create(db.engine, checkfirst=True)
+        except SQLAlchemyError:
+            if index.name not in _existing_indexes(table.name):
+                raise
@@ -1,73 +1,270 @@
 import os
-import cv2
-import numpy as np
 import torch
 import json
 import logging
+import queue
+import threading
+import time
+import tempfile
+from functools import lru_cache
 from transformers import AutoImageProcessor, AutoModelForImageClassification
 from PIL import Image
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Initialize model and processor
 MODEL_PATH = "D:/project3"
+ONNX_PATH = os.path.join(MODEL_PATH, "model.onnx")
+# Resolved per process by prepare_runtime: even probing CUDA in a preloaded
+# gunicorn master would make it unusable in the forked workers
+DEVICE = torch.device("cpu")
 processor = None
 model = None
+session = None  # ONNX Runtime session, used instead of the PyTorch model when available
+ID2LABEL = {}
+_runtime_pid = None  # Process that last placed the model on its device / opened the session
+_runtime_lock = threading.Lock()
+
+def _inference_threads():
+    """Intra-op threads for inference in this process (0 keeps the library default of one per core)
+
+    Read when the runtime is prepared rather than at import, so the gunicorn and Celery
+    hooks can set INFERENCE_THREADS after this module has been imported.
+    """
+    return int(os.environ.get("INFERENCE_THREADS", 0))
+
+def _load_onnx_session():
+    """Export the model to ONNX once and open an ONNX Runtime session on it"""
+    if not os.path.exists(ONNX_PATH):
+        # Export to a unique temporary file and move it into place atomically, so processes
+        # starting at the same time never read a half-written model.onnx
+        fd, temp_path = tempfile.mkstemp(suffix=".onnx.tmp", dir=MODEL_PATH)
+        os.close(fd)
+        try:
+            # The processor always emits a fixed-size image, so only the batch axis is dynamic
+            dummy_inputs = processor(images=Image.new("RGB", (224, 224)), return_tensors="pt")
+            torch.onnx.export(
+                model,
+                (dummy_inputs["pixel_values"],),
+                temp_path,
+                input_names=["pixel_values"],
+                output_names=["logits"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+                opset_version=17
+            )
+            os.replace(temp_path, ONNX_PATH)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.info(f"Exported model to {ONNX_PATH}")
+    
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if _inference_threads():
+        options.intra_op_num_threads = _inference_threads()
+    providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider") if p in ort.get_available_providers()]
+    return ort.InferenceSession(ONNX_PATH, sess_options=options, providers=providers)
 
 def load_model():
     """Load the trained model and processor"""
-    global processor, model
+    global processor, model, ID2LABEL
     if processor is None or model is None:
         try:
             processor = AutoImageProcessor.from_pretrained(MODEL_PATH)
             model = AutoModelForImageClassification.from_pretrained(MODEL_PATH)
             model.eval()  # Set to evaluation mode
+            
+            # Get class names from config once rather than on every prediction
+            with open(os.path.join(MODEL_PATH, "config.json"), "r") as f:
+                ID2LABEL = json.load(f).get("id2label", {})
+            
             logger.info("Model and processor loaded successfully")
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             raise
 
+def prepare_runtime():
+    """Set up the inference backend for the current process
+    
+    CUDA contexts and ONNX Runtime sessions do not survive a fork, so load_model only keeps the
+    weights on the CPU (shared copy-on-write with preloaded gunicorn workers) and each process
+    moves them to the GPU or opens its ONNX session here.
+    """
+    global session, DEVICE, _runtime_pid
+    with _runtime_lock:
+        if _runtime_pid == os.getpid():
+            return
+        
+        # Keep several worker processes from each spinning up one thread per core
+        if _inference_threads():
+            torch.set_num_threads(_inference_threads())
+        
+        # Prefer ONNX Runtime, falling back to PyTorch if the export or session fails
+        session = None
+        if ort is not None:
+            try:
+                session = _load_onnx_session()
+                logger.info(f"Using ONNX Runtime with providers {session.get_providers()}")
+            except Exception as e:
+                logger.warning(f"Could not load ONNX model, falling back to PyTorch: {str(e)}")
+                session = None
+        
+        # Run on the GPU in half precision when one is available, staying on the CPU if that fails
+        DEVICE = torch.device("cpu")
+        if session is None and torch.cuda.is_available():
+            try:
+                model.to("cuda").half()
+                DEVICE = torch.device("cuda")
+            except Exception as e:
+                logger.warning(f"Could not move model to GPU, running on CPU: {str(e)}")
+                model.to(DEVICE).float()
+        
+        _runtime_pid = os.getpid()
+        logger.info(f"Inference runtime ready in process {_runtime_pid} on {DEVICE}")
+
+# Micro-batching settings: concurrent requests are coalesced into a single
+# forward pass of up to MAX_BATCH images, waiting at most MAX_LATENCY_MS
+MAX_BATCH = 8
+MAX_LATENCY_MS = 20
+
+# Uploads are downscaled so their shortest edge is this long before the processor
+# resizes them to the model input
+PREPROCESS_SHORTEST_EDGE = 256
+
+# Pending (image, event, result_slot) items for the batch worker
+_request_queue = queue.Queue()
+_worker_thread = None
+_worker_lock = threading.Lock()
+
 def preprocess_image(image_path):
-    """Preprocess the image for the model"""
+    """Load and decode the image so it is ready to be batched for the model"""
     try:
         # Read the image using PIL
         image = Image.open(image_path)
         
-        # Process the image using the model's processor
-        inputs = processor(images=image, return_tensors="pt")
+        # Let libjpeg decode JPEGs at a reduced scale that still covers the target size
+        # in both dimensions (a no-op for other formats)
+        image.draft("RGB", (PREPROCESS_SHORTEST_EDGE, PREPROCESS_SHORTEST_EDGE))
+        
+        # Force the decode on the caller's thread
+        image = image.convert("RGB")
         
-        return inputs
+        # Shrink so the shortest edge matches the target, keeping the aspect ratio; the
+        # processor only ever downsamples from here, so the model input stays sharp
+        width, height = image.size
+        scale = PREPROCESS_SHORTEST_EDGE / min(width, height)
+        if scale < 1:
+            image = image.resize((round(width * scale), round(height * scale)), Image.Resampling.BILINEAR)
+        
+        return image
     
     except Exception as e:
         logger.error(f"Error preprocessing image: {str(e)}")
         raise
 
-def detect_disease(image_path):
-    """Detect plant disease from an image using the trained model"""
+def _run_batch(images):
+    """Run the model on a batch of images and return a (label, confidence) pair per image"""
+    # Process all images in one call using the model's processor
+    inputs = processor(images=images, return_tensors="pt")
+    
+    if session is not None:
+        # Get model predictions from ONNX Runtime
+        outputs = session.run(None, {"pixel_values": inputs["pixel_values"].numpy()})
+        logits = torch.from_numpy(outputs[0])
+    else:
+        # Move the inputs to the model's device, using pinned memory so the copy can overlap with compute
+        if DEVICE.type == "cuda":
+            inputs = {k: v.pin_memory().to(DEVICE, non_blocking=True) for k, v in inputs.items()}
+        
+        # Get model predictions
+        with torch.inference_mode(), torch.autocast(device_type=DEVICE.type, dtype=torch.float16, enabled=DEVICE.type == "cuda"):
+            outputs = model(**inputs)
+            logits = outputs.logits.float()
+    
+    with torch.inference_mode():
+        probabilities = torch.nn.functional.softmax(logits, dim=-1)
+        
+        # Get top prediction for every row of the batch
+        confidences, top_predictions = torch.max(probabilities, dim=-1)
+    
+    results = []
+    for top_prediction, confidence in zip(top_predictions.tolist(), confidences.tolist()):
+        predicted_class = ID2LABEL.get(str(top_prediction), f"Class_{top_prediction}")
+        results.append((predicted_class, confidence))
+    
+    return results
+
+def _batch_worker():
+    """Drain the request queue into batched model calls"""
+    while True:
+        # Block until there is work, then collect more until the batch is full or the latency budget runs out
+        batch = [_request_queue.get()]
+        deadline = time.monotonic() + MAX_LATENCY_MS / 1000.0
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_request_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        try:
+            results = _run_batch([image for image, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Error running batched inference: {str(e)}")
+            results = [e] * len(batch)
+        
+        # Hand each result back to the waiting request
+        for (_, event, result_slot), result in zip(batch, results):
+            result_slot.append(result)
+            event.set()
+
+def _ensure_worker():
+    """Start the batch worker thread if it is not running in this process"""
+    global _worker_thread
+    with _worker_lock:
+        # Threads do not survive a fork, so forked gunicorn workers start their own
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_batch_worker, name="disease-batch-worker", daemon=True)
+            _worker_thread.start()
+
+def detect_disease(image_path, batched=True):
+    """Detect plant disease from an image using the trained model
+    
+    With batched=False the image skips the micro-batching queue and runs on its own. Use it
+    where calls never overlap (e.g. one task at a time per Celery child), since the queue
+    could never form a batch there and would only add MAX_LATENCY_MS to every call.
+    """
     try:
-        # Ensure model is loaded
+        # Ensure model is loaded and ready in this process
         load_model()
+        prepare_runtime()
         
         # Preprocess the image
-        inputs = preprocess_image(image_path)
+        image = preprocess_image(image_path)
         
-        # Get model predictions
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            probabilities = torch.nn.functional.softmax(logits, dim=-1)
+        if batched:
+            # Queue the image for the batch worker and wait for its result
+            _ensure_worker()
+            event = threading.Event()
+            result_slot = []
+            _request_queue.put((image, event, result_slot))
+            event.wait()
             
-            # Get top prediction
-            top_prediction = torch.argmax(probabilities, dim=-1).item()
-            confidence = probabilities[0][top_prediction].item()
-            
-            # Get class name from config
-            with open(os.path.join(MODEL_PATH, "config.json"), "r") as f:
-                config = json.load(f)
-                id2label = config.get("id2label", {})
-                predicted_class = id2label.get(str(top_prediction), f"Class_{top_prediction}")
+            result = result_slot[0]
+            if isinstance(result, Exception):
+                raise result
+        else:
+            result = _run_batch([image])[0]
+        predicted_class, confidence = result
         
         logger.info(f"Prediction: {predicted_class}, Confidence: {confidence:.4f}")
         return predicted_class, confidence
@@ -76,116 +273,9 @@ def detect_disease(image_path):
         logger.error(f"Error detecting disease: {str(e)}")
         raise
 
-# The class names for the plant disease detection model
-CLASSES = [
-    'Apple_Apple_scab', 'Apple_Black_rot', 'Apple_Cedar_apple_rust', 'Apple_Healthy',
-    'Background_without_leaves', 'Blueberry_Healthy', 'Cherry_Powdery_mildew', 'Cherry_Healthy',
-    'Corn_Cercospora_leaf_spot', 'Corn_Common_rust', 'Corn_Northern_Leaf_Blight', 'Corn_Healthy',
-    'Grape_Black_rot', 'Grape_Esca', 'Grape_Leaf_blight', 'Grape_Healthy',
-    'Orange_Haunglongbing', 'Peach_Bacterial_spot', 'Peach_Healthy',
-    'Pepper_Bacterial_spot', 'Pepper_Healthy', 'Potato_Early_blight', 'Potato_Late_blight', 'Potato_Healthy',
-    'Raspberry_Healthy', 'Soybean_Healthy', 'Squash_Powdery_mildew',
-    'Strawberry_Leaf_scorch', 'Strawberry_Healthy', 'Tomato_Bacterial_spot', 'Tomato_Early_blight',
-    'Tomato_Late_blight', 'Tomato_Leaf_Mold', 'Tomato_Septoria_leaf_spot',
-    'Tomato_Spider_mites', 'Tomato_Target_Spot', 'Tomato_Mosaic_virus', 'Tomato_Yellow_Leaf_Curl_Virus', 'Tomato_Healthy'
-]
-
-# Common disease indicators and their corresponding colors in HSV space
-DISEASE_INDICATORS = {
-    "Brown spots": [(10, 100, 20), (20, 255, 200)],  # Brown
-    "Yellow spots": [(20, 100, 100), (30, 255, 255)],  # Yellow
-    "Black spots": [(0, 0, 0), (180, 255, 30)],  # Black
-    "White powder": [(0, 0, 200), (180, 30, 255)],  # White
-    "Rotting": [(0, 50, 10), (15, 255, 100)]  # Dark brown
-}
-
-def extract_color_features(img):
-    """Extract color features from the image"""
-    # Convert to HSV color space for better color feature extraction
-    hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
-    
-    # Initialize feature vector
-    features = []
-    
-    # Check for each disease indicator (color range)
-    for indicator, (lower, upper) in DISEASE_INDICATORS.items():
-        # Create NumPy arrays from the boundaries
-        lower = np.array(lower, dtype=np.uint8)
-        upper = np.array(upper, dtype=np.uint8)
-        
-        # Find the colors within the specified boundaries
-        mask = cv2.inRange(hsv, lower, upper)
-        
-        # Calculate percentage of image with this color indicator
-        ratio = np.sum(mask > 0) / (img.shape[0] * img.shape[1])
-        features.append(ratio)
-    
-    # Add average color features (mean of each HSV channel)
-    for i in range(3):
-        features.append(np.mean(hsv[:, :, i]) / 255.0)
-    
-    return np.array(features)
-
-def extract_texture_features(img):
-    """Extract texture features using gradient magnitude"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    
-    # Calculate gradient magnitude (simple edge detection)
-    sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-    gradient_mag = np.sqrt(sobelx**2 + sobely**2)
-    
-    # Normalize and add mean, std as features
-    gradient_mag = gradient_mag / gradient_mag.max() if gradient_mag.max() > 0 else gradient_mag
-    
-    features = [
-        np.mean(gradient_mag),  # Average edge strength
-        np.std(gradient_mag),   # Variation in edge strength
-        np.percentile(gradient_mag, 90)  # Strong edge percentile
-    ]
-    
-    return np.array(features)
-
-def simple_disease_classifier(features):
-    """A simple classifier based on extracted features"""
-    # This is a simplified approach that simulates the ResNet model
-    # In a production environment, a properly trained model would be used
-    
-    # Split features
-    color_features = features[:8]  # First 8 features are color-related
-    texture_features = features[8:]  # Last 3 features are texture-related
-    
-    # Check for specific disease patterns based on feature thresholds
-    
-    # High level of brown spots and high edge variation (Apple scab, Black rot)
-    if color_features[0] > 0.15 and texture_features[1] > 0.2:
-        return 1 if random.random() > 0.5 else 0  # Apple_Black_rot or Apple_Apple_scab
-    
-    # High yellow spots (Leaf spot diseases)
-    if color_features[1] > 0.2:
-        return 30  # Tomato_Early_blight
-    
-    # White powdery appearance (Powdery mildew)
-    if color_features[3] > 0.1:
-        return 6  # Cherry_Powdery_mildew
-    
-    # Dark spots (Late blight)
-    if color_features[2] > 0.12:
-        return 31  # Tomato_Late_blight
-    
-    # Check if mostly green (healthy)
-    if np.mean(color_features[:5]) < 0.1 and color_features[5] > 0.4:  # Low disease indicators and high green
-        # Choose a random healthy class
-        healthy_indices = [3, 5, 7, 11, 15, 18, 20, 23, 24, 25, 28, 38]
-        return random.choice(healthy_indices)
-    
-    # Fall back to a random disease if no specific pattern is detected
-    # This simulates the model prediction for demonstration purposes
-    return random.randint(0, len(CLASSES) - 1)
-
+@lru_cache(maxsize=1)
 def load_sample_predictions():
-    """Load sample predictions from JSON file if available"""
+    """Load sample predictions from JSON file if available (cached for the process lifetime)"""
     sample_predictions = [
         ("Apple_Scab", 0.904),
         ("Tomato_Late_blight", 0.856),
@@ -201,22 +291,24 @@ def load_sample_predictions():
         'detection_results.json'
     ]
     
-    for detection_results_file in possible_locations:
-        # Load sample predictions from detection_results.json if available
-        if os.path.exists(detection_results_file):
-            try:
-                with open(detection_results_file, 'r') as f:
-                    results = json.load(f)
-                    loaded_predictions = []
-                    for item in results:
-                        if 'prediction' in item and 'confidence' in item:
-                            loaded_predictions.append((item['prediction'], float(item['confidence'])))
-                    
-                    if loaded_predictions:
-                        sample_predictions = loaded_predictions
-                        logger.info(f"Loaded {len(sample_predictions)} sample predictions from {detection_results_file}")
-                        break  # Stop looking once we've found and loaded a file
-            except Exception as e:
-                logger.warning(f"Failed to load sample predictions from {detection_results_file}: {str(e)}")
+    # Load sample predictions from the first existing detection_results.json that parses
+    existing_locations = (path for path in possible_locations if os.path.exists(path))
+    for detection_results_file in existing_locations:
+        try:
+            with open(detection_results_file, 'r') as f:
+                results = json.load(f)
+                loaded_predictions = [
+                    (item['prediction'], float(item['confidence']))
+                    for item in results
+                    if 'prediction' in item and 'confidence' in item
+                ]
+                
+                if loaded_predictions:
+                    sample_predictions = loaded_predictions
+                    logger.info(f"Loaded {len(sample_predictions)} sample predictions from {detection_results_file}")
+                    break  # Stop looking once we've found and loaded a file
+        except Exception as e:
+            logger.warning(f"Failed to load sample predictions from {detection_results_file}: {str(e)}")
     
-    return sample_predictions
+    # Return a tuple so the cached result cannot be mutated by callers
+    return tuple(sample_predictions)
@@ -0,0 +1,71 @@
+import os
+import logging
+from celery import Celery
+from celery.signals import worker_process_init
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Configure Celery, using Redis as the broker
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
+celery = Celery("tasks", broker=CELERY_BROKER_URL)
+
+def _app_context():
+    """Push a Flask app context for the task"""
+    # Imported here because app.py imports this module while it is starting up
+    from app import app
+    return app.app_context()
+
+@worker_process_init.connect
+def preload_model(**kwargs):
+    """Load the model in each worker process before it picks up any tasks"""
+    # The default prefork pool runs one child per core, so give each child a single
+    # inference thread rather than one per core. When running fewer children, set
+    # INFERENCE_THREADS to cores // concurrency instead.
+    os.environ.setdefault("INFERENCE_THREADS", "1")
+    
+    from plant_disease_detector import load_model, prepare_runtime
+    try:
+        load_model()
+        prepare_runtime()
+    except Exception as e:
+        logger.error(f"Error preloading model in worker: {str(e)}")
+
+@celery.task
+def run_inference(file_path, result_id):
+    """
+    Run disease detection on an uploaded image and store the prediction on its result
+    
+    Args:
+        file_path (str): Path of the saved upload
+        result_id (int): ID of the pending PlantDiseaseResult for the upload
+    
+    Returns:
+        dict: The updated result
+    """
+    from models import db, PlantDiseaseResult
+    from plant_disease_detector import detect_disease
+    from cache_service import cache_delete
+    
+    with _app_context():
+        result = db.session.get(PlantDiseaseResult, result_id)
+        try:
+            # Process the image with the disease detection model; each child runs one
+            # task at a time, so there is nothing to batch with
+            prediction, confidence = detect_disease(file_path, batched=False)
+            result.prediction = prediction
+            result.confidence = float(confidence)
+            result.status = 'completed'
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error running inference for result {result_id}: {str(e)}")
+            db.session.rollback()
+            result.status = 'failed'
+            db.session.commit()
+            raise
+        finally:
+            # Drop any cached copy of the result now that it has changed
+            cache_delete(f"res:{result_id}")
+        
+        return result.to_dict()